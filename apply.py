@@ -4,32 +4,209 @@ apply.py - Execute the move plan, creating category directories and moving files
 """
 
 import argparse
-import hashlib
+import errno
 import json
+import os
 import shutil
 import sys
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, nullcontext
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, Any, List
+from typing import Callable, Dict, Any, BinaryIO, Iterable, Iterator, List, Optional
 
+from hashing import check_algorithm, compute_file_hash, new_hasher
+from jsonlog import (
+    atomic_output,
+    dump_json_line,
+    write_log_footer,
+    write_log_header,
+    write_log_record,
+)
 
-def compute_file_hash(filepath: Path) -> str:
-    """Compute SHA256 hash of a file."""
-    hash_obj = hashlib.sha256()
+# Default number of move threads (suits SSDs; use ~2 for spinning disks)
+DEFAULT_JOBS = 8
+
+
+def load_progress(path: Path) -> Dict[str, Dict[str, Any]]:
+    """
+    Read completed operations from an NDJSON progress log.
+
+    Returns:
+        Operation results keyed by target path
+    """
+    done = {}
+    if not path.exists():
+        return done
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A run killed mid-write can leave a truncated last line
+                continue
+            done[record["target"]] = record
+    return done
+
+
+def open_progress_log(path: Path) -> int:
+    """Open an NDJSON progress log for appending and return its descriptor."""
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+    # Terminate a truncated last line so the next record starts on its own line
+    size = os.fstat(fd).st_size
+    if size and os.pread(fd, 1, size - 1) != b"\n":
+        os.write(fd, b"\n")
+    return fd
+
+
+def run_in_pool(
+    func: Callable[[Dict[str, Any]], Dict[str, Any]],
+    items: Iterable[Dict[str, Any]],
+    jobs: int
+) -> Iterator[Dict[str, Any]]:
+    """
+    Yield func(item) for each item, in order, using a pool of jobs threads.
+
+    At most 2 * jobs items are submitted ahead of the consumer. If the
+    consumer stops early or anything raises (including KeyboardInterrupt),
+    work that has not started is cancelled; only running calls finish.
+    """
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        try:
+            for item in items:
+                pending.append(executor.submit(func, item))
+                if len(pending) >= 2 * jobs:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            # Cancel by hand: shutdown(cancel_futures=True) needs Python 3.9
+            for future in pending:
+                future.cancel()
+
+
+def same_filesystem(first: str, second: str) -> bool:
+    """Check whether two existing paths live on the same device."""
     try:
-        with open(filepath, "rb") as f:
-            for chunk in iter(lambda: f.read(8192), b""):
-                hash_obj.update(chunk)
-        return hash_obj.hexdigest()
-    except (IOError, PermissionError) as e:
-        return f"ERROR:{e}"
+        return os.stat(first).st_dev == os.stat(second).st_dev
+    except OSError:
+        return False
+
+
+def move_file(source: str, target: str, same_fs: bool = False) -> None:
+    """Move a file, using a single rename() when both sides share a filesystem."""
+    if same_fs:
+        try:
+            os.rename(source, target)
+            return
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+    shutil.move(source, target)
+
+
+def execute_operation(
+    op: Dict[str, Any],
+    dry_run: bool = False,
+    verify_hash: bool = False,
+    quiet: bool = False,
+    same_fs: bool = False,
+    hash_algorithm: str = "sha256"
+) -> Dict[str, Any]:
+    """
+    Execute a single move operation.
+
+    The target's parent directory must already exist; apply_plan creates
+    all of them before running any operation.
+
+    Args:
+        op: Operation from the move plan
+        dry_run: If True, only simulate the move
+        verify_hash: Verify file integrity after move
+        quiet: Suppress progress output
+        same_fs: Source and target share a filesystem, so rename() suffices
+        hash_algorithm: Plan hash algorithm; the operation key holding the digest
+
+    Returns:
+        Operation result
+    """
+    # Plain strings and os.path: this runs once per file
+    source = op["source"]
+    target = op["target"]
+    name = os.path.basename(source)
+
+    result = {
+        "source": op["source"],
+        "target": op["target"],
+        "category": op["category"],
+        "status": "pending",
+    }
+
+    # Check if source exists (one lstat, right before the move)
+    if not os.path.lexists(source):
+        result["status"] = "skipped"
+        result["reason"] = "source not found"
+        if not quiet:
+            print(f"[SKIP] {name}: source not found", file=sys.stderr)
+        return result
+
+    # Check if target already exists; rename() would silently replace it.
+    # Asking the filesystem also respects case-insensitive volumes.
+    if os.path.lexists(target):
+        result["status"] = "skipped"
+        result["reason"] = "target exists"
+        if not quiet:
+            print(f"[SKIP] {name}: target exists", file=sys.stderr)
+        return result
+
+    try:
+        if dry_run:
+            result["status"] = "dry_run"
+            if not quiet:
+                print(f"[DRY RUN] {name} -> {op['category']}/", file=sys.stderr)
+        else:
+            # Move the file
+            move_file(source, target, same_fs=same_fs)
+            result["status"] = "success"
+
+            # Verify hash if requested; the move has happened either way, so a
+            # verification error must not turn this into a failed operation
+            if verify_hash and hash_algorithm in op:
+                try:
+                    verified = compute_file_hash(target, hash_algorithm) == op[hash_algorithm]
+                    warning = "Hash mismatch after move"
+                except Exception as e:
+                    verified = False
+                    warning = f"Hash verification failed: {e}"
+                result["hash_verified"] = verified
+                if not verified:
+                    result["warning"] = warning
+
+            if not quiet:
+                print(f"[MOVED] {name} -> {op['category']}/", file=sys.stderr)
+
+    except Exception as e:
+        result["status"] = "failed"
+        result["error"] = str(e)
+        if not quiet:
+            print(f"[FAIL] {name}: {e}", file=sys.stderr)
+
+    return result
 
 
 def apply_plan(
     plan: Dict[str, Any],
     dry_run: bool = False,
     verify_hash: bool = False,
-    quiet: bool = False
+    quiet: bool = False,
+    jobs: int = DEFAULT_JOBS,
+    progress_log: Optional[Path] = None,
+    out_fp: Optional[BinaryIO] = None
 ) -> Dict[str, Any]:
     """
     Execute the move plan.
@@ -39,6 +216,12 @@ def apply_plan(
         dry_run: If True, only simulate moves
         verify_hash: Verify file integrity after move
         quiet: Suppress progress output
+        jobs: Number of threads used to execute moves
+        progress_log: NDJSON file that records each completed move as it
+            happens; recorded moves whose file is still at the target are
+            not redone
+        out_fp: Binary file to stream the JSON log to as operations finish;
+            the returned log then carries no operations, only the stats
 
     Returns:
         Execution log
@@ -55,85 +238,97 @@ def apply_plan(
         },
     }
 
-    target_base = Path(plan["target_base"])
+    # Plans written before --hash-algo existed always carry sha256 digests
+    hash_algorithm = plan.get("hash_algorithm", "sha256")
+
+    # Fail before touching anything if the plan's hash cannot be computed here
+    check_algorithm(hash_algorithm)
+    if verify_hash:
+        new_hasher(hash_algorithm)
 
-    # Create category directories
-    categories = set(op["category"] for op in plan["operations"])
-    for category in categories:
-        cat_dir = target_base / category
+    # Create each target directory once, up front
+    target_dirs = sorted(set(os.path.dirname(op["target"]) for op in plan["operations"]))
+    for target_dir in target_dirs:
         if dry_run:
             if not quiet:
-                print(f"[DRY RUN] Would create directory: {cat_dir}", file=sys.stderr)
+                print(f"[DRY RUN] Would create directory: {target_dir}", file=sys.stderr)
         else:
-            cat_dir.mkdir(parents=True, exist_ok=True)
-
-    # Execute move operations
-    for op in plan["operations"]:
-        source = Path(op["source"])
-        target = Path(op["target"])
-
-        result = {
-            "source": op["source"],
-            "target": op["target"],
-            "category": op["category"],
-            "status": "pending",
-        }
-
-        # Check if source exists
-        if not source.exists():
-            result["status"] = "skipped"
-            result["reason"] = "source not found"
-            log["operations"].append(result)
-            log["stats"]["skipped"] += 1
-            if not quiet:
-                print(f"[SKIP] {source.name}: source not found", file=sys.stderr)
-            continue
-
-        # Check if target already exists
-        if target.exists():
-            result["status"] = "skipped"
-            result["reason"] = "target exists"
-            log["operations"].append(result)
-            log["stats"]["skipped"] += 1
+            os.makedirs(target_dir, exist_ok=True)
+
+    # Same-device moves are plain renames; checked once for the whole plan
+    same_fs = not dry_run and same_filesystem(
+        plan.get("source_directory", ""), plan["target_base"]
+    )
+
+    # Moves finished by an earlier, interrupted run of the same plan
+    done = load_progress(progress_log) if progress_log else {}
+
+    # Append-only and unbuffered, so every completed move survives a crash
+    progress_fd = None
+    if progress_log and not dry_run:
+        progress_fd = open_progress_log(progress_log)
+    progress_lock = threading.Lock()
+
+    def run(op: Dict[str, Any]) -> Dict[str, Any]:
+        # Trust a recorded move only if the disk still agrees: a rollback since
+        # then puts the file back at its source, and it must be moved again
+        previous = done.get(op["target"])
+        if (previous is not None
+                and previous.get("source") == op["source"]
+                and os.path.lexists(op["target"])
+                and not os.path.lexists(op["source"])):
             if not quiet:
-                print(f"[SKIP] {source.name}: target exists", file=sys.stderr)
-            continue
+                print(f"[DONE] {os.path.basename(op['source'])}: moved in a previous run", file=sys.stderr)
+            return previous
+
+        result = execute_operation(
+            op,
+            dry_run=dry_run,
+            verify_hash=verify_hash,
+            quiet=quiet,
+            same_fs=same_fs,
+            hash_algorithm=hash_algorithm
+        )
 
-        try:
-            if dry_run:
-                result["status"] = "dry_run"
-                if not quiet:
-                    print(f"[DRY RUN] {source.name} -> {op['category']}/", file=sys.stderr)
+        if progress_fd is not None and result["status"] == "success":
+            with progress_lock:
+                os.write(progress_fd, dump_json_line(result))
+
+        return result
+
+    def collect(results: Iterable[Dict[str, Any]]) -> None:
+        for index, result in enumerate(results):
+            if result["status"] == "skipped":
+                log["stats"]["skipped"] += 1
+            elif result["status"] == "failed":
+                log["stats"]["failed"] += 1
             else:
-                # Ensure parent directory exists
-                target.parent.mkdir(parents=True, exist_ok=True)
-
-                # Move the file
-                shutil.move(str(source), str(target))
-                result["status"] = "success"
-
-                # Verify hash if requested
-                if verify_hash and "sha256" in op:
-                    new_hash = compute_file_hash(target)
-                    if new_hash == op["sha256"]:
-                        result["hash_verified"] = True
-                    else:
-                        result["hash_verified"] = False
-                        result["warning"] = "Hash mismatch after move"
-
-                if not quiet:
-                    print(f"[MOVED] {source.name} -> {op['category']}/", file=sys.stderr)
-
-            log["stats"]["success"] += 1
-
-        except Exception as e:
-            result["status"] = "failed"
-            result["error"] = str(e)
-            log["stats"]["failed"] += 1
-            if not quiet:
-                print(f"[FAIL] {source.name}: {e}", file=sys.stderr)
+                log["stats"]["success"] += 1
+
+            if out_fp is None:
+                log["operations"].append(result)
+            else:
+                write_log_record(out_fp, result, first=index == 0)
+
+    if out_fp is not None:
+        write_log_header(out_fp, {
+            key: value for key, value in log.items() if key not in ("operations", "stats")
+        })
 
-        log["operations"].append(result)
+    # Execute move operations; plan targets are unique, so moves are independent.
+    # Results are consumed lazily, in plan order, as they complete.
+    try:
+        if jobs <= 1:
+            collect(map(run, plan["operations"]))
+        else:
+            with closing(run_in_pool(run, plan["operations"], jobs)) as results:
+                collect(results)
+    finally:
+        if progress_fd is not None:
+            os.close(progress_fd)
+
+    if out_fp is not None:
+        write_log_footer(out_fp, log["stats"], empty=not any(log["stats"].values()))
 
     return log
 
@@ -161,6 +356,18 @@ def main():
         action="store_true",
         help="Verify file integrity after move"
     )
+    parser.add_argument(
+        "--resume",
+        type=Path,
+        metavar="PROGRESS_LOG",
+        help="Append completed moves to this NDJSON log and skip moves already recorded in it"
+    )
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=DEFAULT_JOBS,
+        help=f"Number of move threads (default: {DEFAULT_JOBS}, use 2 for HDDs)"
+    )
     parser.add_argument(
         "-q", "--quiet",
         action="store_true",
@@ -179,26 +386,31 @@ def main():
             mode = "[DRY RUN] " if args.dry_run else ""
             print(f"{mode}Applying plan with {plan['stats']['total_moves']} operations...", file=sys.stderr)
 
-        log = apply_plan(
-            plan,
-            dry_run=args.dry_run,
-            verify_hash=args.verify_hash,
-            quiet=args.quiet
-        )
+        # Stream the log as moves finish rather than holding every record in
+        # memory; an --output file only replaces the target once complete
+        output = atomic_output(args.output) if args.output else nullcontext(sys.stdout.buffer)
+        with output as out_fp:
+            log = apply_plan(
+                plan,
+                dry_run=args.dry_run,
+                verify_hash=args.verify_hash,
+                quiet=args.quiet,
+                jobs=args.jobs,
+                progress_log=args.resume,
+                out_fp=out_fp
+            )
+
+        if not args.output:
+            sys.stdout.buffer.write(b"\n")
+            sys.stdout.buffer.flush()
 
         if not args.quiet:
             print(f"\nResults: {log['stats']['success']} success, "
                   f"{log['stats']['failed']} failed, "
                   f"{log['stats']['skipped']} skipped", file=sys.stderr)
 
-        json_output = json.dumps(log, indent=2, ensure_ascii=False)
-
-        if args.output:
-            args.output.write_text(json_output)
-            if not args.quiet:
-                print(f"Log saved to {args.output}", file=sys.stderr)
-        else:
-            print(json_output)
+        if args.output and not args.quiet:
+            print(f"Log saved to {args.output}", file=sys.stderr)
 
         return 0 if log["stats"]["failed"] == 0 else 1
 
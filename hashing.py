@@ -0,0 +1,99 @@
+"""
+hashing.py - File hashing shared by scan.py and apply.py.
+"""
+
+import hashlib
+import mmap
+import os
+from pathlib import Path
+from typing import Any, BinaryIO, Union
+
+try:
+    from blake3 import blake3
+except ImportError:  # optional, only needed for blake3 hashing
+    blake3 = None
+
+# Supported hash algorithms; scan entries and plan operations key digests by name
+HASH_ALGORITHMS = ("sha256", "blake3")
+
+# Read size for the pre-3.11 hashing fallback
+HASH_BLOCK_SIZE = 1024 * 1024
+
+# Files at least this large are hashed through mmap instead of read()
+MMAP_MIN_SIZE = 1024 * 1024
+
+# Slice of a mapped file fed to the hash per update()
+MMAP_CHUNK_SIZE = 64 * 1024 * 1024
+
+
+def advise_file(fd: int, offset: int, length: int, advice: str) -> None:
+    """Pass a posix_fadvise() hint if the platform supports it (not macOS)."""
+    if not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        os.posix_fadvise(fd, offset, length, getattr(os, advice))
+    except OSError:
+        # Advice is best effort; some filesystems reject it
+        pass
+
+
+def hash_mapped_file(f: BinaryIO, hash_obj: Any) -> None:
+    """Feed an open file to hash_obj through a read-only memory map."""
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if hasattr(mmap, "MADV_SEQUENTIAL"):
+            mm.madvise(mmap.MADV_SEQUENTIAL)
+        with memoryview(mm) as view:
+            for offset in range(0, len(mm), MMAP_CHUNK_SIZE):
+                # Touching mapped pages past a truncated end raises SIGBUS, which
+                # Python cannot catch. Checking the size before each slice only
+                # narrows that window: a truncation during update() still kills
+                # the process
+                end = min(offset + MMAP_CHUNK_SIZE, len(mm))
+                if os.fstat(f.fileno()).st_size < end:
+                    raise ValueError("file shrank while being hashed")
+                with view[offset:end] as chunk:
+                    hash_obj.update(chunk)
+
+
+def check_algorithm(algorithm: str) -> None:
+    """Raise ValueError unless algorithm is one of HASH_ALGORITHMS."""
+    if algorithm not in HASH_ALGORITHMS:
+        raise ValueError(
+            f"Unsupported hash algorithm: {algorithm!r} "
+            f"(expected one of {', '.join(HASH_ALGORITHMS)})"
+        )
+
+
+def new_hasher(algorithm: str) -> Any:
+    """Create a hash object for one of HASH_ALGORITHMS."""
+    check_algorithm(algorithm)
+    if algorithm == "blake3":
+        if blake3 is None:
+            raise ValueError("blake3 hashing requires the 'blake3' package")
+        # AUTO lets BLAKE3 spread a large input over several threads
+        return blake3(max_threads=blake3.AUTO)
+    return hashlib.new(algorithm)
+
+
+def compute_file_hash(filepath: Union[str, Path], algorithm: str = "sha256") -> str:
+    """Compute hash of a file for integrity checking."""
+    try:
+        with open(filepath, "rb") as f:
+            advise_file(f.fileno(), 0, 0, "POSIX_FADV_SEQUENTIAL")
+            hash_obj = new_hasher(algorithm)
+            if os.fstat(f.fileno()).st_size >= MMAP_MIN_SIZE:
+                try:
+                    hash_mapped_file(f, hash_obj)
+                    return hash_obj.hexdigest()
+                except (OSError, ValueError):
+                    # Not mappable (e.g. ENODEV on some FUSE/network mounts) or
+                    # shrinking underneath us: start over through read()
+                    f.seek(0)
+                    hash_obj = new_hasher(algorithm)
+            if hasattr(hashlib, "file_digest"):
+                return hashlib.file_digest(f, lambda: hash_obj).hexdigest()
+            for chunk in iter(lambda: f.read1(HASH_BLOCK_SIZE), b""):
+                hash_obj.update(chunk)
+        return hash_obj.hexdigest()
+    except (IOError, PermissionError) as e:
+        return f"ERROR:{e}"
@@ -0,0 +1,70 @@
+"""
+jsonlog.py - JSON output helpers shared by the scan, plan, apply and rollback scripts.
+"""
+
+import json
+import os
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Iterator
+
+try:
+    import orjson
+except ImportError:  # optional, the json module is used instead
+    orjson = None
+
+
+def dump_json(data: Any) -> bytes:
+    """Serialize data as indented UTF-8 JSON, using orjson when installed."""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, indent=2, ensure_ascii=False).encode("utf-8")
+
+
+def dump_json_line(data: Any) -> bytes:
+    """Serialize data as a single newline-terminated JSON line (NDJSON)."""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(data, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def write_log_header(out_fp: BinaryIO, header: Dict[str, Any]) -> None:
+    """Start a streamed JSON log: the header fields, then an open operations array."""
+    out_fp.write(dump_json(header)[:-2])  # drop the closing "\n}"
+    out_fp.write(b',\n  "operations": [')
+
+
+def write_log_record(out_fp: BinaryIO, record: Dict[str, Any], first: bool) -> None:
+    """Append one operation to a streamed JSON log."""
+    out_fp.write(b"\n    " if first else b",\n    ")
+    out_fp.write(dump_json(record).replace(b"\n", b"\n    "))
+
+
+def write_log_footer(out_fp: BinaryIO, stats: Dict[str, int], empty: bool) -> None:
+    """Close the operations array of a streamed JSON log and add the stats."""
+    out_fp.write(b"]" if empty else b"\n  ]")
+    out_fp.write(b',\n  "stats": ')
+    out_fp.write(dump_json(stats).replace(b"\n", b"\n  "))
+    out_fp.write(b"\n}")
+
+
+@contextmanager
+def atomic_output(path: Path) -> Iterator[BinaryIO]:
+    """
+    Write to a temporary file next to path, and move it into place only if
+    the block completes.
+
+    On any error the temporary file is removed, so a failed run never leaves
+    an empty or truncated log where a complete one is expected.
+    """
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp_path, "wb") as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
@@ -5,10 +5,36 @@ plan.py - Generate a move plan from scan results.
 
 import argparse
 import json
+import os
 import sys
+import unicodedata
+from collections import Counter
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional, Set
+
+from jsonlog import dump_json
+
+
+def fold_name(name: str) -> str:
+    """
+    Reduce a file name to the form case- and normalization-insensitive
+    filesystems (APFS, NTFS) compare, so other spellings count as taken.
+    """
+    return unicodedata.normalize("NFC", name).casefold()
+
+
+def name_taken(target_dir: str, name: str, existing: Set[str], listed: bool) -> bool:
+    """
+    Check whether a name is already used in a target directory.
+
+    existing holds the folded names listed in the directory plus those handed
+    out so far. If the directory could not be listed, a miss is confirmed
+    with lstat().
+    """
+    if fold_name(name) in existing:
+        return True
+    return not listed and os.path.lexists(os.path.join(target_dir, name))
 
 
 def generate_plan(scan_data: Dict[str, Any], target_base: Path) -> Dict[str, Any]:
@@ -26,6 +52,7 @@ def generate_plan(scan_data: Dict[str, Any], target_base: Path) -> Dict[str, Any
         "created_at": datetime.now().isoformat(),
         "source_directory": scan_data["directory"],
         "target_base": str(target_base.absolute()),
+        "hash_algorithm": scan_data.get("hash_algorithm", "sha256"),
         "operations": [],
         "stats": {
             "total_moves": 0,
@@ -34,40 +61,72 @@ def generate_plan(scan_data: Dict[str, Any], target_base: Path) -> Dict[str, Any
     }
 
     files = scan_data.get("files", {})
+    hash_algorithm = plan["hash_algorithm"]
+    target_base_str = str(target_base)
+
+    # Operations are collected column-wise and only turned into dicts at the end
+    sources: List[str] = []
+    targets: List[str] = []
+    categories: List[str] = []
+    sizes: List[int] = []
+    hashes: List[Optional[str]] = []
 
     for category, file_list in files.items():
         if not file_list:
             continue
 
-        target_dir = target_base / category
-        plan["stats"]["by_category"][category] = len(file_list)
+        target_dir = os.path.join(target_base_str, category)
+
+        # Folded names already in the target directory plus names handed out below
+        listed = True
+        try:
+            existing = {fold_name(entry) for entry in os.listdir(target_dir)}
+        except FileNotFoundError:
+            # Not created yet, so nothing in it can be taken
+            existing = set()
+        except OSError:
+            # Unreadable; name_taken() asks the filesystem name by name
+            existing = set()
+            listed = False
 
         for file_info in file_list:
-            source = Path(file_info["path"])
-            target = target_dir / file_info["name"]
+            name = file_info["name"]
 
             # Handle name conflicts
-            counter = 1
-            original_target = target
-            while target.exists():
-                stem = original_target.stem
-                suffix = original_target.suffix
-                target = target_dir / f"{stem}_{counter}{suffix}"
-                counter += 1
-
-            operation = {
-                "action": "move",
-                "source": str(source),
-                "target": str(target),
-                "category": category,
-                "size": file_info["size"],
-            }
-
-            if "sha256" in file_info:
-                operation["sha256"] = file_info["sha256"]
-
-            plan["operations"].append(operation)
-            plan["stats"]["total_moves"] += 1
+            target_name = name
+            if name_taken(target_dir, name, existing, listed):
+                original = Path(name)
+                stem = original.stem
+                suffix = original.suffix
+                counter = 1
+                while name_taken(target_dir, target_name, existing, listed):
+                    target_name = f"{stem}_{counter}{suffix}"
+                    counter += 1
+            existing.add(fold_name(target_name))
+            target = os.path.join(target_dir, target_name)
+
+            sources.append(file_info["path"])
+            targets.append(target)
+            categories.append(category)
+            sizes.append(file_info["size"])
+            hashes.append(file_info.get(hash_algorithm))
+
+    for source, target, category, size, digest in zip(sources, targets, categories, sizes, hashes):
+        operation = {
+            "action": "move",
+            "source": source,
+            "target": target,
+            "category": category,
+            "size": size,
+        }
+
+        if digest is not None:
+            operation[hash_algorithm] = digest
+
+        plan["operations"].append(operation)
+
+    plan["stats"]["total_moves"] = len(sources)
+    plan["stats"]["by_category"] = dict(Counter(categories))
 
     return plan
 
@@ -115,14 +174,15 @@ def main():
             for cat, count in plan["stats"]["by_category"].items():
                 print(f"  {cat}: {count} files", file=sys.stderr)
 
-        json_output = json.dumps(plan, indent=2, ensure_ascii=False)
+        json_output = dump_json(plan)
 
         if args.output:
-            args.output.write_text(json_output)
+            args.output.write_bytes(json_output)
             if not args.quiet:
                 print(f"Plan saved to {args.output}", file=sys.stderr)
         else:
-            print(json_output)
+            sys.stdout.buffer.write(json_output)
+            sys.stdout.buffer.write(b"\n")
 
         return 0
 
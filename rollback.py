@@ -5,17 +5,22 @@ rollback.py - Undo the last apply by reading the move log.
 
 import argparse
 import json
+import os
 import shutil
 import sys
+from contextlib import nullcontext
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, BinaryIO, Optional
+
+from jsonlog import atomic_output, write_log_footer, write_log_header, write_log_record
 
 
 def rollback_operations(
     log: Dict[str, Any],
     dry_run: bool = False,
-    quiet: bool = False
+    quiet: bool = False,
+    out_fp: Optional[BinaryIO] = None
 ) -> Dict[str, Any]:
     """
     Rollback move operations from a log.
@@ -24,6 +29,8 @@ def rollback_operations(
         log: Execution log from apply.py
         dry_run: If True, only simulate rollback
         quiet: Suppress progress output
+        out_fp: Binary file to stream the JSON rollback log to as operations
+            finish; the returned log then carries no operations, only the stats
 
     Returns:
         Rollback result log
@@ -49,35 +56,52 @@ def rollback_operations(
     if not quiet:
         print(f"Found {len(successful_ops)} operations to rollback", file=sys.stderr)
 
+    if out_fp is not None:
+        write_log_header(out_fp, {
+            key: value for key, value in rollback_log.items() if key not in ("operations", "stats")
+        })
+
+    recorded = 0
+
+    def record(result: Dict[str, Any]) -> None:
+        nonlocal recorded
+        if out_fp is None:
+            rollback_log["operations"].append(result)
+        else:
+            write_log_record(out_fp, result, first=recorded == 0)
+        recorded += 1
+
     # Reverse order to undo in reverse
     for op in reversed(successful_ops):
-        source = Path(op["target"])  # Current location (was target)
-        target = Path(op["source"])  # Original location (was source)
+        source = op["target"]  # Current location (was target)
+        target = op["source"]  # Original location (was source)
+        name = os.path.basename(source)
+        target_dir = os.path.dirname(target)
 
         result = {
-            "source": str(source),
-            "target": str(target),
+            "source": source,
+            "target": target,
             "status": "pending",
         }
 
         # Check if current file exists
-        if not source.exists():
+        if not os.path.exists(source):
             result["status"] = "skipped"
             result["reason"] = "file not found at target location"
-            rollback_log["operations"].append(result)
+            record(result)
             rollback_log["stats"]["skipped"] += 1
             if not quiet:
-                print(f"[SKIP] {source.name}: not found", file=sys.stderr)
+                print(f"[SKIP] {name}: not found", file=sys.stderr)
             continue
 
         # Check if original location is occupied
-        if target.exists():
+        if os.path.exists(target):
             result["status"] = "skipped"
             result["reason"] = "original location occupied"
-            rollback_log["operations"].append(result)
+            record(result)
             rollback_log["stats"]["skipped"] += 1
             if not quiet:
-                print(f"[SKIP] {source.name}: original location occupied", file=sys.stderr)
+                print(f"[SKIP] {name}: original location occupied", file=sys.stderr)
             continue
 
         try:
@@ -87,14 +111,14 @@ def rollback_operations(
                     print(f"[DRY RUN] {source} -> {target}", file=sys.stderr)
             else:
                 # Ensure parent directory exists
-                target.parent.mkdir(parents=True, exist_ok=True)
+                os.makedirs(target_dir, exist_ok=True)
 
                 # Move back
-                shutil.move(str(source), str(target))
+                shutil.move(source, target)
                 result["status"] = "success"
 
                 if not quiet:
-                    print(f"[RESTORED] {source.name} -> {target.parent.name}/", file=sys.stderr)
+                    print(f"[RESTORED] {name} -> {os.path.basename(target_dir)}/", file=sys.stderr)
 
             rollback_log["stats"]["success"] += 1
 
@@ -103,9 +127,12 @@ def rollback_operations(
             result["error"] = str(e)
             rollback_log["stats"]["failed"] += 1
             if not quiet:
-                print(f"[FAIL] {source.name}: {e}", file=sys.stderr)
+                print(f"[FAIL] {name}: {e}", file=sys.stderr)
 
-        rollback_log["operations"].append(result)
+        record(result)
+
+    if out_fp is not None:
+        write_log_footer(out_fp, rollback_log["stats"], empty=recorded == 0)
 
     return rollback_log
 
@@ -113,15 +140,17 @@ def rollback_operations(
 def cleanup_empty_dirs(base_dir: Path, quiet: bool = False) -> int:
     """Remove empty category directories after rollback."""
     removed = 0
-    for category_dir in base_dir.iterdir():
-        if category_dir.is_dir() and not any(category_dir.iterdir()):
-            try:
-                category_dir.rmdir()
-                removed += 1
-                if not quiet:
-                    print(f"[CLEANUP] Removed empty directory: {category_dir.name}", file=sys.stderr)
-            except OSError:
-                pass
+    with os.scandir(base_dir) as it:
+        # DirEntry.is_dir() uses the dirent type; rmdir() itself refuses non-empty dirs
+        category_dirs = [entry for entry in it if entry.is_dir()]
+    for category_dir in category_dirs:
+        try:
+            os.rmdir(category_dir.path)
+            removed += 1
+            if not quiet:
+                print(f"[CLEANUP] Removed empty directory: {category_dir.name}", file=sys.stderr)
+        except OSError:
+            pass
     return removed
 
 
@@ -170,30 +199,35 @@ def main():
             mode = "[DRY RUN] " if args.dry_run else ""
             print(f"{mode}Rolling back operations...", file=sys.stderr)
 
-        rollback_log = rollback_operations(log, dry_run=args.dry_run, quiet=args.quiet)
+        # Stream the log as files are restored rather than holding every record
+        # in memory; an --output file only replaces the target once complete
+        output = atomic_output(args.output) if args.output else nullcontext(sys.stdout.buffer)
+        with output as out_fp:
+            rollback_log = rollback_operations(
+                log, dry_run=args.dry_run, quiet=args.quiet, out_fp=out_fp
+            )
+
+        if not args.output:
+            sys.stdout.buffer.write(b"\n")
+            sys.stdout.buffer.flush()
 
         if args.cleanup and not args.dry_run:
-            target_base = Path(log.get("plan_source", ""))
-            # Try to find target base from operations
-            if rollback_log["operations"]:
-                first_op = rollback_log["operations"][0]
-                if "source" in first_op:
-                    target_base = Path(first_op["source"]).parent.parent
-                    cleanup_empty_dirs(target_base, quiet=args.quiet)
+            # Find the target base from a moved file: <base>/<category>/<name>
+            moved = next(
+                (op for op in log.get("operations", []) if op.get("status") == "success"),
+                None
+            )
+            if moved is not None:
+                target_base = Path(moved["target"]).parent.parent
+                cleanup_empty_dirs(target_base, quiet=args.quiet)
 
         if not args.quiet:
             print(f"\nResults: {rollback_log['stats']['success']} restored, "
                   f"{rollback_log['stats']['failed']} failed, "
                   f"{rollback_log['stats']['skipped']} skipped", file=sys.stderr)
 
-        json_output = json.dumps(rollback_log, indent=2, ensure_ascii=False)
-
-        if args.output:
-            args.output.write_text(json_output)
-            if not args.quiet:
-                print(f"Log saved to {args.output}", file=sys.stderr)
-        else:
-            print(json_output)
+        if args.output and not args.quiet:
+            print(f"Log saved to {args.output}", file=sys.stderr)
 
         return 0 if rollback_log["stats"]["failed"] == 0 else 1
 
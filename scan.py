@@ -4,13 +4,22 @@ scan.py - Scan Downloads directory and categorize files by extension.
 """
 
 import argparse
-import hashlib
-import json
 import os
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Union
+
+from hashing import HASH_ALGORITHMS, advise_file, compute_file_hash
+from jsonlog import dump_json
+
+# Leading bytes of an upcoming file to ask the kernel to read ahead
+PREFETCH_SIZE = 64 * 1024 * 1024
+
+# Default number of hashing threads (suits SSDs; use ~2 for spinning disks)
+DEFAULT_JOBS = 8
 
 # File categories by extension
 CATEGORIES = {
@@ -23,35 +32,81 @@ CATEGORIES = {
     "Audio": [".mp3", ".wav", ".flac", ".aac", ".ogg", ".m4a"],
 }
 
+# Extension -> category lookup; the first category listing an extension wins
+EXT_TO_CATEGORY: Dict[str, str] = {
+    ext: category
+    for category, extensions in reversed(list(CATEGORIES.items()))
+    for ext in extensions
+}
+
 
 def get_category(ext: str) -> str:
     """Get category for a file extension."""
-    ext_lower = ext.lower()
-    for category, extensions in CATEGORIES.items():
-        if ext_lower in extensions:
-            return category
-    return "Other"
+    return EXT_TO_CATEGORY.get(ext.lower(), "Other")
+
 
+def get_extension(name: str) -> str:
+    """Get the extension of a file name, with the same rules as Path.suffix."""
+    i = name.rfind(".")
+    if 0 < i < len(name) - 1:
+        return name[i:]
+    return ""
 
-def compute_file_hash(filepath: Path, algorithm: str = "sha256") -> str:
-    """Compute hash of a file for integrity checking."""
-    hash_obj = hashlib.new(algorithm)
+
+def prefetch_file(filepath: Union[str, Path]) -> None:
+    """Start reading the beginning of a file into the page cache in the background."""
+    if not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        fd = os.open(filepath, os.O_RDONLY)
+    except OSError:
+        return
     try:
-        with open(filepath, "rb") as f:
-            for chunk in iter(lambda: f.read(8192), b""):
-                hash_obj.update(chunk)
-        return hash_obj.hexdigest()
-    except (IOError, PermissionError) as e:
-        return f"ERROR:{e}"
+        advise_file(fd, 0, PREFETCH_SIZE, "POSIX_FADV_WILLNEED")
+    finally:
+        os.close(fd)
 
 
-def scan_directory(directory: Path, include_hash: bool = False) -> Dict[str, Any]:
+def compute_file_hashes(
+    filepaths: List[Union[str, Path]],
+    algorithm: str = "sha256",
+    jobs: int = DEFAULT_JOBS
+) -> List[str]:
+    """Compute hashes for a batch of files, in the same order as given."""
+    # Each worker prefetches the file that will be picked up once the files
+    # currently in flight are done, so its cold read overlaps their hashing
+    ahead = max(jobs, 1)
+
+    def hash_one(index: int) -> str:
+        if index + ahead < len(filepaths):
+            prefetch_file(filepaths[index + ahead])
+        return compute_file_hash(filepaths[index], algorithm)
+
+    if jobs <= 1 or len(filepaths) <= 1:
+        return [hash_one(index) for index in range(len(filepaths))]
+
+    # hashlib releases the GIL while hashing, so threads overlap I/O and compute
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(hash_one, range(len(filepaths))))
+
+
+def scan_directory(
+    directory: Path,
+    include_hash: bool = False,
+    jobs: int = DEFAULT_JOBS,
+    hash_algorithm: str = "sha256",
+    iso_times: bool = False
+) -> Dict[str, Any]:
     """
     Scan a directory and categorize all files.
 
     Args:
         directory: Path to scan
         include_hash: Whether to compute file hashes
+        jobs: Number of threads used for hashing
+        hash_algorithm: One of HASH_ALGORITHMS
+        iso_times: Report modification times as local ISO 8601 strings
+            instead of POSIX timestamps
 
     Returns:
         Dictionary with scan results
@@ -64,48 +119,79 @@ def scan_directory(directory: Path, include_hash: bool = False) -> Dict[str, Any
         "by_category": {},
     }
 
+    # Per-category byte totals, accumulated during the walk
+    category_sizes = dict.fromkeys(results, 0)
+
     if not directory.exists():
         raise FileNotFoundError(f"Directory not found: {directory}")
 
     if not directory.is_dir():
         raise NotADirectoryError(f"Not a directory: {directory}")
 
-    for item in directory.iterdir():
-        if item.is_file():
-            ext = item.suffix
-            category = get_category(ext)
-
-            file_info = {
-                "name": item.name,
-                "path": str(item.absolute()),
-                "extension": ext,
-                "size": item.stat().st_size,
-                "modified": datetime.fromtimestamp(item.stat().st_mtime).isoformat(),
-                "category": category,
-            }
+    base = str(directory.absolute())
 
-            if include_hash:
-                file_info["sha256"] = compute_file_hash(item)
+    # One scandir pass: is_file() is answered from the dirent type where possible.
+    # Each entry is stat()ed here, before hashing, so a file renamed or removed
+    # meanwhile (e.g. a finished .part download) is skipped rather than fatal
+    entries = []
+    with os.scandir(directory) as it:
+        for entry in it:
+            if not entry.is_file():
+                continue
+            try:
+                entries.append((entry, entry.stat()))
+            except FileNotFoundError:
+                continue
 
-            results[category].append(file_info)
-            stats["total_files"] += 1
-            stats["total_size"] += file_info["size"]
+    paths = [os.path.join(base, entry.name) for entry, _ in entries]
+
+    # Hash the whole batch up front rather than interleaving it with the walk
+    hashes = compute_file_hashes(paths, hash_algorithm, jobs=jobs) if include_hash else None
+
+    for index, (entry, st) in enumerate(entries):
+        ext = get_extension(entry.name)
+        category = get_category(ext)
+
+        file_info = {
+            "name": entry.name,
+            "path": paths[index],
+            "extension": ext,
+            "size": st.st_size,
+            "modified": (
+                time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(st.st_mtime))
+                if iso_times else st.st_mtime
+            ),
+            "category": category,
+        }
+
+        if hashes is not None:
+            file_info[hash_algorithm] = hashes[index]
+
+        results[category].append(file_info)
+        stats["total_files"] += 1
+        stats["total_size"] += st.st_size
+        category_sizes[category] += st.st_size
 
     # Compute category stats
     for category, files in results.items():
         if files:
             stats["by_category"][category] = {
                 "count": len(files),
-                "size": sum(f["size"] for f in files),
+                "size": category_sizes[category],
             }
 
-    return {
+    report = {
         "scan_time": datetime.now().isoformat(),
         "directory": str(directory.absolute()),
         "stats": stats,
         "files": results,
     }
 
+    if include_hash:
+        report["hash_algorithm"] = hash_algorithm
+
+    return report
+
 
 def main():
     parser = argparse.ArgumentParser(description="Scan Downloads directory and categorize files.")
@@ -123,7 +209,24 @@ def main():
     parser.add_argument(
         "--hash",
         action="store_true",
-        help="Include SHA256 hash for each file"
+        help="Include a hash for each file (see --hash-algo)"
+    )
+    parser.add_argument(
+        "--hash-algo",
+        choices=HASH_ALGORITHMS,
+        default="sha256",
+        help="Hash algorithm for --hash (default: sha256; blake3 needs the blake3 package)"
+    )
+    parser.add_argument(
+        "--iso-times",
+        action="store_true",
+        help="Report modification times as ISO 8601 strings instead of timestamps"
+    )
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=DEFAULT_JOBS,
+        help=f"Number of hashing threads (default: {DEFAULT_JOBS}, use 2 for HDDs)"
     )
     parser.add_argument(
         "-q", "--quiet",
@@ -137,19 +240,26 @@ def main():
         if not args.quiet:
             print(f"Scanning {args.directory}...", file=sys.stderr)
 
-        results = scan_directory(args.directory, include_hash=args.hash)
+        results = scan_directory(
+            args.directory,
+            include_hash=args.hash,
+            jobs=args.jobs,
+            hash_algorithm=args.hash_algo,
+            iso_times=args.iso_times
+        )
 
         if not args.quiet:
             print(f"Found {results['stats']['total_files']} files", file=sys.stderr)
 
-        json_output = json.dumps(results, indent=2, ensure_ascii=False)
+        json_output = dump_json(results)
 
         if args.output:
-            args.output.write_text(json_output)
+            args.output.write_bytes(json_output)
             if not args.quiet:
                 print(f"Report saved to {args.output}", file=sys.stderr)
         else:
-            print(json_output)
+            sys.stdout.buffer.write(json_output)
+            sys.stdout.buffer.write(b"\n")
 
         return 0
 